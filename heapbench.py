@@ -23,36 +23,84 @@ the heap and so are not the main strength of a heap implementation.
 
 Heaps provide O(lgN) insertion and O(lgN) removal of the smallest (or
 largest) element. However, they are sometimes inefficient when
-processing sorted data. To check for this, we use 3 different data
-sets when benchmarking:
+processing sorted data. To check for this, we use several different
+data sets when benchmarking:
 
 1. Items added in ascending order (smallest to largest).
 2. Items added in descending order (largest to smallest).
 3. Items added in random order.
+4. Items added nearly sorted, each a few places from its position.
+5. Items with many duplicate priorities.
+6. Items in several ascending runs (sawtooth).
+7. Items ascending and then descending (organ pipe).
+8. Items with Zipf-distributed priorities.
+9. Items from periodic timers with jitter.
 
 Many real-world situations provide mostly-sorted data, so these tests
 are meaningful. (For example, a priority queue operating on items that
-have the same interval will tend to be roughly sorted.)
+have the same interval will tend to be roughly sorted.) The data sets
+are built by the heapdata module, from a seed so that they are the
+same on every run.
 
 We will also benchmark on small, medium, and large heap sizes.
 Implementations may make decisions that optimize for small heaps, for
 example.
 """
 
+import cProfile
+import collections
+import concurrent.futures
+import copy
+import gc
+import importlib.metadata
+import itertools
+import math
+import multiprocessing
+import os
 import perf
+import pstats
 import random
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
 
 import binaryheap
 import fibonacci_heap_mod
+import heapcache
+import heapcompare
+import heapdata
 import heapdict
+import heaphist
 import heapq
 import heapqueue
+import mmapheap
 import pyheapq
 
 
 #
 # Here we define our various insertion tests.
 #
+# Removal is timed on a heap built by insertion. Rather than insert the
+# items again before every loop, we take a snapshot of the heap once and
+# restore a copy of it each time, which gives the same heap. A copy
+# shares the item objects with the snapshot, as a heap built from the
+# same items would, so that the items are laid out in memory the same
+# way and only the structure holding them is new.
+#
+
+def clone_heap(h):
+    """return a copy of a heap object that keeps its items in lists,
+       sharing the items but copying the lists"""
+    clone = copy.copy(h)
+    for name, value in vars(clone).items():
+        if isinstance(value, list):
+            setattr(clone, name, value[:])
+    return clone
+
 
 def insert_heapdict(items):
     """insert the items into a heapdict object"""
@@ -62,15 +110,49 @@ def insert_heapdict(items):
     return h
 
 
+def drain_heapdict(h):
+    """remove all of the items from a heapdict object"""
+    while len(h) > 0:
+        h.popitem()
+
+
+def snapshot_heapdict(items):
+    """insert the items into a heapdict object, and return a snapshot of it"""
+    return insert_heapdict(items)
+
+
+def restore_heapdict(snapshot):
+    """return a copy of the heapdict object in the snapshot"""
+    # A heapdict keeps a [priority, key, index] list for each key, both in
+    # its heap and in its dictionary, and popping changes them, so each
+    # one is copied.
+    h = heapdict.heapdict()
+    # Collecting garbage as often as usual while a million of these are
+    # made costs several times as much as making them, so the collector
+    # waits until they are all made. It then collects the young objects
+    # once, as it would have along the way, rather than in the timed part.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        h.heap = [wrapper[:] for wrapper in snapshot.heap]
+        h.d = {wrapper[1]: wrapper for wrapper in h.heap}
+    finally:
+        if enabled:
+            gc.enable()
+    gc.collect(1)
+    return h
+
+
 def bench_remove_heapdict(loops, items):
-    """insert the items into a heapdict object, then time removing them"""
+    """insert the items into a heapdict object once, then time removing them
+       from copies of it"""
+    snapshot = snapshot_heapdict(items)
     range_it = range(loops)
     time_total = 0
     for loops in range_it:
-        h = insert_heapdict(items)
+        h = restore_heapdict(snapshot)
         t0 = perf.perf_counter()
-        while len(h) > 0:
-            h.popitem()
+        drain_heapdict(h)
         t1 = perf.perf_counter()
         time_total += t1 - t0
     return time_total
@@ -84,15 +166,33 @@ def insert_heapq(items):
     return h
 
 
+def drain_heapq(h):
+    """remove all of the items from a heap list using the heapq module"""
+    while h:
+        heapq.heappop(h)
+
+
+def snapshot_heapq(items):
+    """insert the items into a heap list using the heapq module, and
+       return a snapshot of it"""
+    return insert_heapq(items)
+
+
+def restore_heapq(snapshot):
+    """return a copy of the heap list in the snapshot"""
+    return snapshot[:]
+
+
 def bench_remove_heapq(loops, items):
-    """insert the items into a heap list, then time removing them"""
+    """insert the items into a heap list once, then time removing them from
+       copies of it"""
+    snapshot = snapshot_heapq(items)
     range_it = range(loops)
     time_total = 0
     for loops in range_it:
-        h = insert_heapq(items)
+        h = restore_heapq(snapshot)
         t0 = perf.perf_counter()
-        while h:
-            heapq.heappop(h)
+        drain_heapq(h)
         t1 = perf.perf_counter()
         time_total += t1 - t0
     return time_total
@@ -106,16 +206,34 @@ def insert_pyheapq(items):
     return h
 
 
+def drain_pyheapq(h):
+    """remove all of the items from a heap list using a Python-only version
+       of heapq"""
+    while h:
+        pyheapq.heappop(h)
+
+
+def snapshot_pyheapq(items):
+    """insert the items into a heap list using a Python-only version of
+       heapq, and return a snapshot of it"""
+    return insert_pyheapq(items)
+
+
+def restore_pyheapq(snapshot):
+    """return a copy of the heap list in the snapshot"""
+    return snapshot[:]
+
+
 def bench_remove_pyheapq(loops, items):
-    """insert the items into a heap list with Python-only version of heapq,
-       then time removing them"""
+    """insert the items into a heap list with Python-only version of heapq
+       once, then time removing them from copies of it"""
+    snapshot = snapshot_pyheapq(items)
     range_it = range(loops)
     time_total = 0
     for loops in range_it:
-        h = insert_pyheapq(items)
+        h = restore_pyheapq(snapshot)
         t0 = perf.perf_counter()
-        while h:
-            pyheapq.heappop(h)
+        drain_pyheapq(h)
         t1 = perf.perf_counter()
         time_total += t1 - t0
     return time_total
@@ -129,44 +247,87 @@ def insert_binaryheap(items):
     return h
 
 
+def drain_binaryheap(h):
+    """remove all of the items from a binaryheap object"""
+    while h:
+        h.extract_one()
+
+
+def snapshot_binaryheap(items):
+    """insert the items into a binaryheap object, and return a snapshot of
+       it"""
+    return insert_binaryheap(items)
+
+
+def restore_binaryheap(snapshot):
+    """return a copy of the binaryheap object in the snapshot"""
+    return clone_heap(snapshot)
+
+
 def bench_remove_binaryheap(loops, items):
-    """insert the items into a binaryheap, then time removing them"""
+    """insert the items into a binaryheap once, then time removing them from
+       copies of it"""
+    snapshot = snapshot_binaryheap(items)
     range_it = range(loops)
     time_total = 0
     for loops in range_it:
-        h = insert_binaryheap(items)
+        h = restore_binaryheap(snapshot)
         t0 = perf.perf_counter()
-        while h:
-            h.extract_one()
+        drain_binaryheap(h)
         t1 = perf.perf_counter()
         time_total += t1 - t0
     return time_total
 
 
+def list_cmp(a, b):
+    """compare two items for a heapqueue object"""
+    if a < b:
+        return -1
+    if a > b:
+        return 1
+    return 0
+
+
+def new_heapqueue():
+    """return an empty heapqueue object"""
+    kwargs = {'cmp': list_cmp}
+    return heapqueue.HeapQueue(**kwargs)
+
+
 def insert_heapqueue(items):
     """insert the items into a heapqueue object"""
-    def list_cmp(a, b):
-        if a < b:
-            return -1
-        if a > b:
-            return 1
-        return 0
-    kwargs = {'cmp': list_cmp}
-    h = heapqueue.HeapQueue(**kwargs)
+    h = new_heapqueue()
     for item in items:
         h.push(item)
     return h
 
 
+def drain_heapqueue(h):
+    """remove all of the items from a heapqueue object"""
+    while h.pop() is not None:
+        pass
+
+
+def snapshot_heapqueue(items):
+    """insert the items into a heapqueue object, and return a snapshot of it"""
+    return insert_heapqueue(items)
+
+
+def restore_heapqueue(snapshot):
+    """return a copy of the heapqueue object in the snapshot"""
+    return clone_heap(snapshot)
+
+
 def bench_remove_heapqueue(loops, items):
-    """insert the items into a heapqueue, then time removing them"""
+    """insert the items into a heapqueue once, then time removing them from
+       copies of it"""
+    snapshot = snapshot_heapqueue(items)
     range_it = range(loops)
     time_total = 0
     for loops in range_it:
-        h = insert_heapqueue(items)
+        h = restore_heapqueue(snapshot)
         t0 = perf.perf_counter()
-        while h.pop() is not None:
-            pass
+        drain_heapqueue(h)
         t1 = perf.perf_counter()
         time_total += t1 - t0
     return time_total
@@ -180,142 +341,1061 @@ def insert_fibheap(items):
     return h
 
 
+def drain_fibheap(h):
+    """remove all of the items from a Fibonacci heap object"""
+    while h:
+        h.dequeue_min()
+
+
+def snapshot_fibheap(items):
+    """return a snapshot of a Fibonacci heap holding the items"""
+    # The nodes of a Fibonacci heap are linked into long lists, which
+    # cloning would have to walk. But enqueue() only adds a node to the
+    # root list, so rebuilding the heap costs no more than that.
+    return list(items)
+
+
+def restore_fibheap(snapshot):
+    """return a Fibonacci heap holding the items in the snapshot"""
+    return insert_fibheap(snapshot)
+
+
 def bench_remove_fibheap(loops, items):
-    """insert the items into a Fibonacci heap, then time removing them"""
+    """insert the items into a Fibonacci heap once, then time removing them
+       from copies of it"""
+    snapshot = snapshot_fibheap(items)
     range_it = range(loops)
     time_total = 0
     for loops in range_it:
-        h = insert_fibheap(items)
+        h = restore_fibheap(snapshot)
         t0 = perf.perf_counter()
-        while h:
-            h.dequeue_min()
+        drain_fibheap(h)
         t1 = perf.perf_counter()
         time_total += t1 - t0
     return time_total
 
 
+#
+# Single push and pop operations, for when we look at one operation at
+# a time. The heapq and pyheapq functions are used as they are.
+#
+
+def push_heapdict(h, item):
+    """push one item onto a heapdict object"""
+    h[item] = item[0]
+
+
+def pop_heapdict(h):
+    """pop the smallest item off a heapdict object"""
+    return h.popitem()
+
+
+def push_binaryheap(h, item):
+    """push one item onto a binaryheap object"""
+    h.add(item)
+
+
+def pop_binaryheap(h):
+    """pop the smallest item off a binaryheap object"""
+    return h.extract_one()
+
+
+def push_heapqueue(h, item):
+    """push one item onto a heapqueue object"""
+    h.push(item)
+
+
+def pop_heapqueue(h):
+    """pop the smallest item off a heapqueue object"""
+    return h.pop()
+
+
+def push_fibheap(h, item):
+    """push one item onto a Fibonacci heap object"""
+    h.enqueue(item, item[0])
+
+
+def pop_fibheap(h):
+    """pop the smallest item off a Fibonacci heap object"""
+    return h.dequeue_min()
+
+
+#
+# Each heap implementation has a short name, the names used when
+# reporting insertion and removal benchmarks, a function to insert
+# items, a function to remove all items again, the function used to
+# benchmark removal, and functions to create an empty heap and to push
+# or pop a single item.
+#
+
+Implementation = collections.namedtuple(
+    'Implementation',
+    'name insert_name remove_name insert drain bench_remove new push pop')
+
+IMPLEMENTATIONS = [
+    Implementation('heapdict', 'heapdict[]', 'heapdict.popitem()',
+                   insert_heapdict, drain_heapdict, bench_remove_heapdict,
+                   heapdict.heapdict, push_heapdict, pop_heapdict),
+    Implementation('heapq', 'heapq.heappush()', 'heapq.heappop()',
+                   insert_heapq, drain_heapq, bench_remove_heapq,
+                   list, heapq.heappush, heapq.heappop),
+    Implementation('pyheapq', 'pyheapq.heappush()', 'pyheapq.heappop()',
+                   insert_pyheapq, drain_pyheapq, bench_remove_pyheapq,
+                   list, pyheapq.heappush, pyheapq.heappop),
+    Implementation('binaryheap', 'binaryheap.add()',
+                   'binaryheap.extract_one()',
+                   insert_binaryheap, drain_binaryheap,
+                   bench_remove_binaryheap,
+                   binaryheap.new_min_heap, push_binaryheap, pop_binaryheap),
+    Implementation('heapqueue', 'heapqueue.push()', 'heapqueue.pop()',
+                   insert_heapqueue, drain_heapqueue, bench_remove_heapqueue,
+                   new_heapqueue, push_heapqueue, pop_heapqueue),
+    Implementation('fibonacci_heap_mod', 'fibonacci_heap_mod.enqueue()',
+                   'fibonacci_heap_mod.dequeue_min()',
+                   insert_fibheap, drain_fibheap, bench_remove_fibheap,
+                   fibonacci_heap_mod.Fibonacci_heap, push_fibheap,
+                   pop_fibheap),
+]
+
+# The heap sizes that we benchmark, along with the name used in reports.
+SIZES = [
+    (1000, '1K'),
+    (1000000, '1M'),
+]
+
+
 #
 # Now do the actual benchmarking, using the perf module.
 #
 
-runner = perf.Runner()
-
-# Build a small array in order, and insert each entry.
-items = [(n,) for n in range(1000)]
-runner.bench_func('heapdict[] ascending, N=1K',
-                  insert_heapdict, items)
-runner.bench_func('heapq.heappush() ascending, N=1K',
-                  insert_heapq, items)
-runner.bench_func('pyheapq.heappush() ascending, N=1K',
-                  insert_pyheapq, items)
-runner.bench_func('binaryheap.add() ascending, N=1K',
-                  insert_binaryheap, items)
-runner.bench_func('heapqueue.push() ascending, N=1K',
-                  insert_heapqueue, items)
-runner.bench_func('fibonacci_heap_mod.enqueue() ascending, N=1K',
-                  insert_fibheap, items)
-
-# Build a small array in reverse order, and insert each entry.
-items = [(n,) for n in range(1000, 0, -1)]
-runner.bench_func('heapdict[] descending, N=1K',
-                  insert_heapdict, items)
-runner.bench_func('heapq.heappush() descending, N=1K',
-                  insert_heapq, items)
-runner.bench_func('pyheapq.heappush() descending, N=1K',
-                  insert_pyheapq, items)
-runner.bench_func('binaryheap.add() descending, N=1K',
-                  insert_binaryheap, items)
-runner.bench_func('heapqueue.push() descending, N=1K',
-                  insert_heapqueue, items)
-runner.bench_func('fibonacci_heap_mod.enqueue() descending, N=1K',
-                  insert_fibheap, items)
-
-# Randomize the small array, and insert each entry.
-random.shuffle(items)
-runner.bench_func('heapdict[] random order, N=1K',
-                  insert_heapdict, items)
-runner.bench_func('heapq.heappush() random order, N=1K',
-                  insert_heapq, items)
-runner.bench_func('pyheapq.heappush() random order, N=1K',
-                  insert_pyheapq, items)
-runner.bench_func('binaryheap.add() random order, N=1K',
-                  insert_binaryheap, items)
-runner.bench_func('heapqueue.push() random order, N=1K',
-                  insert_heapqueue, items)
-runner.bench_func('fibonacci_heap_mod.enqueue() random order, N=1K',
-                  insert_fibheap, items)
-
-# Build a big array in order, and insert each entry.
-items = [(n,) for n in range(1000000)]
-runner.bench_func('heapdict[] ascending, N=1M',
-                  insert_heapdict, items)
-runner.bench_func('heapq.heappush() ascending, N=1M',
-                  insert_heapq, items)
-runner.bench_func('pyheapq.heappush() ascending, N=1M',
-                  insert_pyheapq, items)
-runner.bench_func('binaryheap.add() ascending, N=1M',
-                  insert_binaryheap, items)
-runner.bench_func('heapqueue.push() ascending, N=1M',
-                  insert_heapqueue, items)
-runner.bench_func('fibonacci_heap_mod.enqueue() ascending, N=1M',
-                  insert_fibheap, items)
-
-# Build a big array in reverse order, and insert each entry.
-items = [(n,) for n in range(1000000, 0, -1)]
-runner.bench_func('heapdict[] descending, N=1M',
-                  insert_heapdict, items)
-runner.bench_func('heapq.heappush() descending, N=1M',
-                  insert_heapq, items)
-runner.bench_func('pyheapq.heappush() descending, N=1M',
-                  insert_pyheapq, items)
-runner.bench_func('binaryheap.add() descending, N=1M',
-                  insert_binaryheap, items)
-runner.bench_func('heapqueue.push() descending, N=1M',
-                  insert_heapqueue, items)
-runner.bench_func('fibonacci_heap_mod.enqueue() descending, N=1M',
-                  insert_fibheap, items)
-
-# Randomize the big array, and insert each entry.
-random.shuffle(items)
-runner.bench_func('heapdict[] random order, N=1M',
-                  insert_heapdict, items)
-runner.bench_func('heapq.heappush() random order, N=1M',
-                  insert_heapq, items)
-runner.bench_func('pyheapq.heappush() random order, N=1M',
-                  insert_pyheapq, items)
-runner.bench_func('binaryheap.add() random order, N=1M',
-                  insert_binaryheap, items)
-runner.bench_func('heapqueue.push() random order, N=1M',
-                  insert_heapqueue, items)
-runner.bench_func('fibonacci_heap_mod.enqueue() random order, N=1M',
-                  insert_fibheap, items)
-
-# Build a small array, see how long it takes to remove this.
-items = [(n,) for n in range(1000)]
-runner.bench_sample_func('heapdict.popitem(), N=1K',
-                         bench_remove_heapdict, items, inner_loops=10)
-runner.bench_sample_func('heapq.heappop(), N=1K',
-                         bench_remove_heapq, items, inner_loops=10)
-runner.bench_sample_func('pyheapq.heappop(), N=1K',
-                         bench_remove_pyheapq, items, inner_loops=10)
-runner.bench_sample_func('binaryheap.extract_one(), N=1K',
-                         bench_remove_binaryheap, items, inner_loops=10)
-runner.bench_sample_func('heapqueue.pop(), N=1K',
-                         bench_remove_heapqueue, items, inner_loops=10)
-runner.bench_sample_func('fibonacci_heap_mod.dequeue_min(), N=1K',
-                         bench_remove_fibheap, items, inner_loops=10)
-
-# Build a big array, see how long it takes to remove this.
-items = [(n,) for n in range(1000000)]
-runner.bench_sample_func('heapdict.popitem(), N=1M',
-                         bench_remove_heapdict, items, inner_loops=10)
-runner.bench_sample_func('heapq.heappop(), N=1M',
-                         bench_remove_heapq, items, inner_loops=10)
-runner.bench_sample_func('pyheapq.heappop(), N=1M',
-                         bench_remove_pyheapq, items, inner_loops=10)
-runner.bench_sample_func('binaryheap.extract_one(), N=1M',
-                         bench_remove_binaryheap, items, inner_loops=10)
-runner.bench_sample_func('heapqueue.pop(), N=1M',
-                         bench_remove_heapqueue, items, inner_loops=10)
-runner.bench_sample_func('fibonacci_heap_mod.dequeue_min(), N=1M',
-                         bench_remove_fibheap, items, inner_loops=10)
+def benchmarks():
+    """generate the name, implementation, operation ('insert' or
+       'remove'), data set name, and size of every timing benchmark"""
+    # Building a data set of 1M items takes seconds, so only the names
+    # are generated here, and each data set is built when it is needed.
+    for size, size_name in SIZES:
+        # Insert each entry of each data set.
+        for data_name, build in heapdata.DATASETS:
+            for impl in IMPLEMENTATIONS:
+                name = '%s %s, N=%s' % (impl.insert_name, data_name,
+                                        size_name)
+                yield name, impl, 'insert', data_name, size
+
+    for size, size_name in SIZES:
+        # Build a heap from each data set, see how long it takes to
+        # remove this. Removal was only measured after ascending
+        # insertion at first, so those benchmarks keep their old names.
+        for data_name, build in heapdata.DATASETS:
+            for impl in IMPLEMENTATIONS:
+                if data_name == 'ascending':
+                    name = '%s, N=%s' % (impl.remove_name, size_name)
+                else:
+                    name = '%s %s, N=%s' % (impl.remove_name, data_name,
+                                            size_name)
+                yield name, impl, 'remove', data_name, size
+
+
+def bench_time(runner, seed, only=None):
+    """time insertion and removal for every implementation, data set,
+       and size, or only the benchmark with the given name"""
+    args = runner.args
+    # perf numbers the benchmarks in the order that they are run, and
+    # each worker process runs this again but only calls the function of
+    # the benchmark with its own number. The manager process never calls
+    # one, so only the worker that will needs the items.
+    task = 0
+    cached = None
+    for name, impl, op, data_name, size in benchmarks():
+        if only is not None and name != only:
+            continue
+        items = None
+        if args.worker and args.worker_task in (None, task):
+            # Insertion and removal use the same data sets, so keep the
+            # last one in case the next benchmark needs it.
+            if cached is None or cached[0] != (data_name, size):
+                cached = ((data_name, size),
+                          heapdata.dataset(data_name, size, seed))
+            items = cached[1]
+        task += 1
+        if op == 'insert':
+            runner.bench_func(name, impl.insert, items)
+        else:
+            runner.bench_sample_func(name, impl.bench_remove, items,
+                                     inner_loops=10)
+        if only is not None:
+            break
+
+
+#
+# Memory mode. Rather than timing the heaps, we measure how much memory
+# they use. Each measurement runs in a fresh process, so that the peak
+# RSS is not hidden by whatever was measured before it.
+#
+
+def max_rss():
+    """return the peak resident set size of this process, in bytes"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports this in kilobytes, macOS in bytes.
+    if sys.platform == 'darwin':
+        return maxrss
+    return maxrss * 1024
+
+
+def measure_memory(impl, size, seed):
+    """build a heap of randomly ordered items, returning a dictionary of
+       memory measurements"""
+    items = heapdata.shuffled(size, random.Random(seed))
+    gc.collect()
+
+    # The first pass runs without tracemalloc, since its own bookkeeping
+    # would show up in the RSS.
+    h = impl.insert(items)
+    rss_peak = max_rss()
+    del h
+    gc.collect()
+
+    # The second pass uses tracemalloc to find the Python memory used by
+    # the heap itself. Only memory allocated after tracing starts is
+    # counted, so the items are not included.
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    h = impl.insert(items)
+    traced_built, traced_peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    del h
+    tracemalloc.stop()
+    blocks = (sum(stat.count for stat in after.statistics('filename')) -
+              sum(stat.count for stat in before.statistics('filename')))
+
+    return {
+        'bytes per entry': traced_built / size,
+        'blocks per entry': blocks / size,
+        'peak bytes building': traced_peak,
+        'peak RSS': rss_peak,
+    }
+
+
+# Each measurement is repeated this many times, so that heapcompare.py
+# has more than one value to test.
+MEMORY_RUNS = 3
+
+
+def bench_memory(seed, output):
+    """measure memory use for every implementation and size, saving the
+       results to output as perf JSON"""
+    # Each measurement with its perf unit and the format for printing.
+    formats = [
+        ('bytes per entry', 'byte', heapcompare.format_bytes),
+        ('blocks per entry', 'integer', lambda value: '%.2f' % value),
+        ('peak bytes building', 'byte', heapcompare.format_bytes),
+        ('peak RSS', 'byte', heapcompare.format_bytes),
+    ]
+    saved = []
+    # Replacing the worker after every task gives each measurement a
+    # process of its own.
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for size, size_name in SIZES:
+            for impl in IMPLEMENTATIONS:
+                results = [pool.apply(measure_memory, (impl, size, seed))
+                           for n in range(MEMORY_RUNS)]
+                for key, unit, fmt in formats:
+                    name = '%s %s, N=%s' % (impl.name, key, size_name)
+                    values = [result[key] for result in results]
+                    print('%s: %s' % (name, fmt(sum(values) / len(values))))
+                    metadata = dict(package_versions(), name=name,
+                                    unit=unit)
+                    run = perf.Run(values, metadata=metadata)
+                    saved.append(perf.Benchmark([run]))
+    perf.BenchmarkSuite(saved).dump(output)
+
+
+#
+# Instrumented mode. Timing on a shared machine is noisy, so here we
+# count comparisons instead, along with the loop iterations and moves
+# made by the sift functions in pyheapq. These counts do not depend on
+# the machine, so they can catch algorithmic changes anywhere.
+#
+
+class CountingKey(int):
+    """an integer that counts how many times it is ordered"""
+    comparisons = 0
+
+    def __lt__(self, other):
+        CountingKey.comparisons += 1
+        return int.__lt__(self, other)
+
+    def __le__(self, other):
+        CountingKey.comparisons += 1
+        return int.__le__(self, other)
+
+    def __gt__(self, other):
+        CountingKey.comparisons += 1
+        return int.__gt__(self, other)
+
+    def __ge__(self, other):
+        CountingKey.comparisons += 1
+        return int.__ge__(self, other)
+
+
+def count_operations(impl, items):
+    """insert and then remove the items, returning a dictionary of the
+       counts per operation"""
+    size = len(items)
+    counts = {}
+
+    pyheapq.enable_counters()
+    CountingKey.comparisons = 0
+    h = impl.insert(items)
+    counts['push comparisons'] = CountingKey.comparisons / size
+    counts['push sift loops'] = (pyheapq.counters['siftdown_loops'] +
+                                 pyheapq.counters['siftup_loops']) / size
+    counts['push sift moves'] = (pyheapq.counters['siftdown_moves'] +
+                                 pyheapq.counters['siftup_moves']) / size
+
+    pyheapq.reset_counters()
+    CountingKey.comparisons = 0
+    impl.drain(h)
+    counts['pop comparisons'] = CountingKey.comparisons / size
+    counts['pop sift loops'] = (pyheapq.counters['siftdown_loops'] +
+                                pyheapq.counters['siftup_loops']) / size
+    counts['pop sift moves'] = (pyheapq.counters['siftdown_moves'] +
+                                pyheapq.counters['siftup_moves']) / size
+    pyheapq.disable_counters()
+
+    return counts
+
+
+def bench_count(seed):
+    """count the work done per operation for every implementation, data
+       set, and size"""
+    for size, size_name in SIZES:
+        for data_name, items in heapdata.datasets(size, seed):
+            # Every element is counted, not only the priority: where two
+            # priorities are equal, the tie-breaker after it decides the
+            # order. Comparing two tuples orders only the first elements
+            # that differ, so each comparison of items counts once.
+            items = [tuple(CountingKey(part) for part in item)
+                     for item in items]
+            for impl in IMPLEMENTATIONS:
+                counts = count_operations(impl, items)
+                # Only pyheapq uses the sift functions that we count.
+                if impl.name == 'pyheapq':
+                    keys = list(counts)
+                else:
+                    keys = ['push comparisons', 'pop comparisons']
+                for key in keys:
+                    print('%s %s %s, N=%s: %.3f per op' %
+                          (impl.name, key, data_name, size_name,
+                           counts[key]))
+
+
+#
+# Sweep mode. Per-call overhead dominates small heaps and cache misses
+# dominate large ones, so we time each implementation over a range of
+# sizes, fit the cost per operation to a*log2(N) + b, and report the
+# sizes where the fastest implementations change places.
+#
+
+# Sizes spaced evenly on a log scale, from 100 to 10M.
+SWEEP_SIZES = [int(round(10 ** (e / 2))) for e in range(4, 15)]
+
+# The fewest runs that each size is timed with, so that the large sizes,
+# where the cache cliffs are, are not ranked on one noisy run.
+SWEEP_MIN_RUNS = 3
+
+
+def format_size(size):
+    """format a heap size the way we name them in benchmarks"""
+    for suffix, scale in (('M', 1000000), ('K', 1000)):
+        if size >= scale:
+            return '%.3g%s' % (size / scale, suffix)
+    return str(size)
+
+
+def time_operations(impl, items):
+    """return the time per push and per pop for the items, as the best of
+       enough runs to make a million operations, and at least
+       SWEEP_MIN_RUNS"""
+    size = len(items)
+    best_push = best_pop = float('inf')
+    for run in range(max(SWEEP_MIN_RUNS, 1000000 // size)):
+        t0 = perf.perf_counter()
+        h = impl.insert(items)
+        t1 = perf.perf_counter()
+        impl.drain(h)
+        t2 = perf.perf_counter()
+        best_push = min(best_push, (t1 - t0) / size)
+        best_pop = min(best_pop, (t2 - t1) / size)
+    return best_push, best_pop
+
+
+def fit_log(sizes, costs):
+    """fit the costs to a*log2(N) + b with least squares, returning a
+       and b"""
+    xs = [math.log2(size) for size in sizes]
+    x_mean = sum(xs) / len(xs)
+    y_mean = sum(costs) / len(costs)
+    sxx = sum((x - x_mean) ** 2 for x in xs)
+    sxy = sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, costs))
+    a = sxy / sxx if sxx else 0.0
+    return a, y_mean - a * x_mean
+
+
+def bench_sweep(max_size, seed):
+    """time every implementation over a range of sizes"""
+    sizes = [size for size in SWEEP_SIZES if size <= max_size]
+    costs = {impl.name: {'push': [], 'pop': []} for impl in IMPLEMENTATIONS}
+    previous = None
+    for size in sizes:
+        items = heapdata.shuffled(size, random.Random(seed))
+        for impl in IMPLEMENTATIONS:
+            push, pop = time_operations(impl, items)
+            costs[impl.name]['push'].append(push)
+            costs[impl.name]['pop'].append(pop)
+            print('%s push, N=%s: %.1f ns per op' %
+                  (impl.name, format_size(size), push * 1e9))
+            print('%s pop, N=%s: %.1f ns per op' %
+                  (impl.name, format_size(size), pop * 1e9))
+
+        # Rank by the cost of a push plus a pop, the life of one item.
+        ranking = sorted(IMPLEMENTATIONS,
+                         key=lambda impl: (costs[impl.name]['push'][-1] +
+                                           costs[impl.name]['pop'][-1]))
+        ranking = [impl.name for impl in ranking]
+        if previous is None:
+            print('ranking, N=%s: %s' %
+                  (format_size(size), ', '.join(ranking)))
+        elif ranking != previous:
+            print('ranking changes, N=%s: %s' %
+                  (format_size(size), ', '.join(ranking)))
+        previous = ranking
+
+    for impl in IMPLEMENTATIONS:
+        for op in ('push', 'pop'):
+            a, b = fit_log(sizes, costs[impl.name][op])
+            print('%s %s fit: %.2f ns * log2(N) %+.1f ns' %
+                  (impl.name, op, a * 1e9, b * 1e9))
+
+
+#
+# Latency mode. The timing benchmarks report the total time to fill or
+# empty a heap, but a scheduler cares about the slowest operations, and
+# structures with amortized costs can stall now and then. Here we time
+# every push and pop on its own and report percentiles.
+#
+
+# The percentiles reported for each operation.
+PERCENTILES = [50, 99, 99.9]
+
+
+def format_ns(value):
+    """format a number of nanoseconds the way heapcompare.py does"""
+    return heapcompare.format_seconds(value / 1e9)
+
+
+def measure_latency(impl, items):
+    """push and then pop every item, returning histograms of the time
+       taken by each push and by each pop"""
+    clock = time.perf_counter_ns
+    push, pop = impl.push, impl.pop
+    push_hist = heaphist.LatencyHistogram()
+    pop_hist = heaphist.LatencyHistogram()
+    h = impl.new()
+    for item in items:
+        t0 = clock()
+        push(h, item)
+        t1 = clock()
+        push_hist.record(t1 - t0)
+    for n in range(len(items)):
+        t0 = clock()
+        pop(h)
+        t1 = clock()
+        pop_hist.record(t1 - t0)
+    return push_hist, pop_hist
+
+
+def bench_latency(seed):
+    """report push and pop latency for every implementation, data set,
+       and size"""
+    for size, size_name in SIZES:
+        for data_name, items in heapdata.datasets(size, seed):
+            for impl in IMPLEMENTATIONS:
+                hists = measure_latency(impl, items)
+                for op, hist in zip(('push', 'pop'), hists):
+                    values = ['p%g %s' % (percent,
+                                          format_ns(hist.percentile(percent)))
+                              for percent in PERCENTILES]
+                    values.append('max %s' % format_ns(hist.max))
+                    print('%s %s latency %s, N=%s: %s' %
+                          (impl.name, op, data_name, size_name,
+                           ', '.join(values)))
+
+
+#
+# Cache mode. The point of all this is to pick a heap for a cache, so
+# here we replay Zipf-distributed traffic against a heapcache.HeapCache
+# using each heap as its backend, with each eviction policy. Every
+# request gets its key, and sets it on a miss.
+#
+
+# The cache sizes that we replay traffic against. There are ten times as
+# many requests, and ten times as many different keys.
+CACHE_SIZES = [
+    (1000, '1K'),
+    (100000, '100K'),
+]
+
+
+def cache_backend(impl):
+    """return a heapcache backend using the implementation"""
+    if impl.name == 'heapdict':
+        return heapcache.HeapdictBackend(heapdict.heapdict)
+    if impl.name == 'fibonacci_heap_mod':
+        return heapcache.FibonacciBackend(fibonacci_heap_mod.Fibonacci_heap)
+    return heapcache.LazyBackend(impl.new, impl.push, impl.pop)
+
+
+def replay_cache(impl, policy, capacity, keys):
+    """replay the keys against a cache, returning its hit rate, the
+       requests per second, and a histogram of the time taken by each
+       request"""
+    # Time for the cache is counted in requests, so that expiry is the
+    # same on every run.
+    now = [0]
+    ttl = capacity if policy == 'ttl' else None
+    cache = heapcache.HeapCache(capacity, cache_backend(impl), policy,
+                                ttl=ttl, clock=lambda: now[0])
+    clock = time.perf_counter_ns
+    hist = heaphist.LatencyHistogram()
+    total = 0
+    for key in keys:
+        now[0] += 1
+        t0 = clock()
+        if cache.get(key) is None:
+            # Some keys cost more to fetch again than others.
+            cache.set(key, key, cost=1 + key % 10)
+        t1 = clock()
+        hist.record(t1 - t0)
+        total += t1 - t0
+    return cache.hits / len(keys), len(keys) * 1e9 / total, hist
+
+
+def bench_cache(seed):
+    """report the hit rate, throughput, and latency of a cache using each
+       implementation and eviction policy"""
+    for size, size_name in CACHE_SIZES:
+        keys = [key for key, n in
+                heapdata.zipf(size * 10, random.Random(seed))]
+        for impl in IMPLEMENTATIONS:
+            for policy in heapcache.HeapCache.POLICIES:
+                hit_rate, throughput, hist = replay_cache(impl, policy, size,
+                                                          keys)
+                values = ['hit rate %.1f%%' % (hit_rate * 100),
+                          '%.0f requests/sec' % throughput]
+                values.extend('p%g %s' % (percent,
+                                          format_ns(hist.percentile(percent)))
+                              for percent in PERCENTILES)
+                values.append('max %s' % format_ns(hist.max))
+                print('%s %s cache, N=%s: %s' %
+                      (impl.name, policy, size_name, ', '.join(values)))
+
+
+#
+# Memory-mapped heap mode. A scheduler that restarts has to rebuild its
+# heap, unless the heap lives in a file, as with mmapheap.MmapHeap. Here
+# we compare the time to restart, and the cost of the steady state of
+# popping the next record and pushing it back with a later priority,
+# for a heap in a file and for a list heap in memory.
+#
+
+# Number of pop and push pairs timed in the steady state, and with
+# sync=True, which waits for the disk.
+STEADY_OPS = 100000
+SYNC_OPS = 1000
+
+
+def time_steady(pop, push, h, ops):
+    """return the time per operation of popping a record and pushing it
+       back with a later priority, ops times"""
+    t0 = perf.perf_counter()
+    for n in range(ops):
+        priority, payload = pop(h)
+        push(h, (priority + 1000.0, payload))
+    t1 = perf.perf_counter()
+    return (t1 - t0) / (2 * ops)
+
+
+def time_best(func, repeat=5):
+    """return the best time of several calls to func()"""
+    best = float('inf')
+    for n in range(repeat):
+        t0 = perf.perf_counter()
+        func()
+        t1 = perf.perf_counter()
+        best = min(best, t1 - t0)
+    return best
+
+
+def bench_mmap(seed):
+    """compare a heap in a memory-mapped file with one in memory"""
+    for size, size_name in SIZES:
+        records = [(float(item[0]), n) for n, item in
+                   enumerate(heapdata.shuffled(size, random.Random(seed)))]
+        ops = min(size, STEADY_OPS)
+        results = []
+
+        # In memory, a restart rebuilds the heap from the records.
+        def rebuild():
+            h = list(records)
+            pyheapq.heapify(h)
+            return h
+        results.append(('list heap restart', time_best(rebuild)))
+        # Every steady state starts from the same heap: MmapHeap.create()
+        # lays out its file with pyheapq.heapify() too.
+        heap = rebuild()
+        results.append(('list heap pyheapq push/pop', time_steady(
+            pyheapq.heappop, pyheapq.heappush, list(heap), ops)))
+        results.append(('list heap heapq push/pop', time_steady(
+            heapq.heappop, heapq.heappush, list(heap), ops)))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'heap')
+            mmapheap.MmapHeap.create(path, records).close()
+
+            def reopen():
+                h = mmapheap.MmapHeap(path)
+                h.close()
+            results.append(('mmapheap restart', time_best(reopen)))
+            with mmapheap.MmapHeap(path) as h:
+                results.append(('mmapheap push/pop', time_steady(
+                    mmapheap.MmapHeap.popmin, mmapheap.MmapHeap.push,
+                    h, ops)))
+            sync_path = os.path.join(tmpdir, 'sync')
+            with mmapheap.MmapHeap.create(sync_path, records,
+                                          sync=True) as h:
+                results.append(('mmapheap sync push/pop', time_steady(
+                    mmapheap.MmapHeap.popmin, mmapheap.MmapHeap.push,
+                    h, min(ops, SYNC_OPS))))
+
+        for name, seconds in results:
+            print('%s, N=%s: %s' % (name, size_name, format_ns(seconds * 1e9)))
+
+
+#
+# Peek mode. Reading the first few items of a heap in order, without
+# taking them off it, used to mean copying the heap and popping, or
+# nsmallest(), both O(n). pyheapq.iter_sorted() walks the heap instead,
+# in O(k log k) for the first k items.
+#
+
+# The numbers of items read from the front of the heap.
+PEEK_COUNTS = [1, 10, 100]
+
+
+def peek_copy(heap, k):
+    """return the first k items by popping them off a copy of the heap"""
+    h = list(heap)
+    return [pyheapq.heappop(h) for n in range(min(k, len(h)))]
+
+
+def peek_nsmallest(heap, k):
+    """return the first k items using nsmallest()"""
+    return pyheapq.nsmallest(k, heap)
+
+
+def peek_iter(heap, k):
+    """return the first k items using iter_sorted()"""
+    return list(itertools.islice(pyheapq.iter_sorted(heap), k))
+
+
+PEEKS = [
+    ('copy and pop', peek_copy),
+    ('nsmallest()', peek_nsmallest),
+    ('iter_sorted()', peek_iter),
+]
+
+
+def bench_peek(seed):
+    """time reading the first few items of a heap in order"""
+    for size, size_name in SIZES:
+        heap = heapdata.shuffled(size, random.Random(seed))
+        pyheapq.heapify(heap)
+        for k in PEEK_COUNTS:
+            for name, peek in PEEKS:
+                seconds = time_best(lambda: peek(heap, k))
+                print('%s, k=%d, N=%s: %s' %
+                      (name, k, size_name, format_ns(seconds * 1e9)))
+
+
+#
+# Profiling. To see where the time goes in one benchmark, we run it
+# once under cProfile, and once under a sampling profiler that is cheap
+# enough not to change the picture, writing pstats and collapsed stacks
+# that flamegraph.pl or speedscope can draw.
+#
+
+def sample_stacks(prepare, interval=0.001, min_samples=1000,
+                  max_time=10.0):
+    """call the function returned by prepare() again and again, sampling
+       its stack every interval seconds of CPU time, until there are
+       min_samples samples or it has run for max_time seconds of CPU
+       time, and return a Counter of the stacks in collapsed form"""
+    stacks = collections.Counter()
+    # The timer keeps running while prepare() builds the next heap, since
+    # stopping and starting it loses the time counted so far, and a small
+    # benchmark is over long before one interval has passed. Samples are
+    # only kept while func() runs.
+    running = [False]
+
+    def sample(signum, frame):
+        if not running[0]:
+            return
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('%s (%s:%d)' % (code.co_name,
+                                         os.path.basename(code.co_filename),
+                                         code.co_firstlineno))
+            frame = frame.f_back
+        stacks[';'.join(reversed(names))] += 1
+
+    previous = signal.signal(signal.SIGPROF, sample)
+    signal.setitimer(signal.ITIMER_PROF, interval, interval)
+    cpu_time = 0.0
+    try:
+        while (sum(stacks.values()) < min_samples and
+               cpu_time < max_time):
+            func = prepare()
+            t0 = time.process_time()
+            running[0] = True
+            try:
+                func()
+            finally:
+                running[0] = False
+            cpu_time += time.process_time() - t0
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, previous)
+    return stacks
+
+
+def time_breakdown(stats):
+    """return the time spent in each part of the code, according to the
+       pstats.Stats, as a dictionary"""
+    parts = collections.OrderedDict((part, 0.0) for part in (
+        'pyheapq sift functions', 'other pyheapq functions',
+        'heapbench harness', 'heap packages and builtins'))
+    for (filename, line, funcname), stat in stats.stats.items():
+        own_time = stat[2]
+        module = os.path.basename(filename)
+        if module == 'pyheapq.py' and funcname.startswith('_sift'):
+            parts['pyheapq sift functions'] += own_time
+        elif module == 'pyheapq.py':
+            parts['other pyheapq functions'] += own_time
+        elif module == 'heapbench.py':
+            parts['heapbench harness'] += own_time
+        else:
+            parts['heap packages and builtins'] += own_time
+    return parts
+
+
+def profile_benchmark(name, prefix, seed):
+    """profile one timing benchmark, writing prefix.pstats and
+       prefix.collapsed"""
+    for bench_name, impl, op, data_name, size in benchmarks():
+        if bench_name == name:
+            break
+    else:
+        print('unknown benchmark %r, expected one of:' % name)
+        for bench_name, impl, op, data_name, size in benchmarks():
+            print('    %s' % bench_name)
+        sys.exit(1)
+    items = heapdata.dataset(data_name, size, seed)
+
+    def prepare():
+        """return a function running the timed part of the benchmark"""
+        if op == 'insert':
+            return lambda: impl.insert(items)
+        # Removal benchmarks only time removal, so build the heap first.
+        h = impl.insert(items)
+        return lambda: impl.drain(h)
+
+    directory = os.path.dirname(prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    profile = cProfile.Profile()
+    profile.runcall(prepare())
+    profile.dump_stats(prefix + '.pstats')
+    stats = pstats.Stats(profile)
+    total = sum(stat[2] for stat in stats.stats.values())
+    for part, part_time in time_breakdown(stats).items():
+        print('%s: %s: %.1f%% (%.3f sec)' %
+              (name, part, 100 * part_time / total if total else 0,
+               part_time))
+
+    stacks = sample_stacks(prepare)
+    with open(prefix + '.collapsed', 'w') as collapsed:
+        for stack, count in sorted(stacks.items()):
+            collapsed.write('%s %d\n' % (stack, count))
+    print('wrote %s.pstats and %s.collapsed' % (prefix, prefix))
+
+
+#
+# Results are saved so that runs can be compared, for example after
+# upgrading a heap package or Python itself. perf records the Python
+# version and the CPU, and we add the version of each heap package.
+#
+
+# The directory that results are saved in, unless -o is used.
+RESULTS_DIR = 'results'
+
+# The distributions of the heap packages that we benchmark.
+PACKAGES = [
+    'binaryheap',
+    'fibonacci-heap-mod',
+    'heapdict',
+    'heapqueue',
+]
+
+
+def package_versions():
+    """return the version of each installed heap package, as metadata"""
+    versions = {}
+    for package in PACKAGES:
+        try:
+            version = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            continue
+        versions['%s_version' % package.replace('-', '_')] = version
+    return versions
+
+
+def add_metadata(runner):
+    """record the version of each heap package in the results"""
+    runner.metadata.update(package_versions())
+
+
+def default_output(prefix='heapbench'):
+    """return a new file name for saving the results of this run"""
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    name = time.strftime(prefix + '-%Y%m%d-%H%M%S.json')
+    return os.path.join(RESULTS_DIR, name)
+
+
+#
+# Parallel scheduling. The benchmarks are independent of each other, so
+# on a machine with many cores we can run several at once, each in its
+# own heapbench.py process pinned to its own CPU. Large heaps compete
+# for memory bandwidth, so fewer of those run at the same time. Each
+# process saves its results to a file, and at the end we merge them.
+#
+
+# Benchmarks of at least this many items count as large.
+LARGE_SIZE = 100000
+
+# Options that the scheduler sets itself for each process it starts,
+# so must not pass on. All of them take a value.
+SCHEDULER_OPTIONS = {
+    '--jobs', '--large-jobs', '--cpus', '--only',
+    '-o', '--output', '--affinity',
+}
+
+
+def parse_cpus(text):
+    """return the CPUs in a list like '0-3,8' as a sorted list"""
+    cpus = set()
+    for part in text.split(','):
+        part = part.strip()
+        if part:
+            first, _, last = part.partition('-')
+            cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def available_cpus():
+    """return the isolated CPUs if there are any, otherwise every CPU
+       that we may run on"""
+    try:
+        with open('/sys/devices/system/cpu/isolated') as isolated:
+            cpus = parse_cpus(isolated.read())
+    except OSError:
+        cpus = []
+    return cpus or sorted(os.sched_getaffinity(0))
+
+
+def child_options(argv):
+    """return the command line options to pass on to each process"""
+    options = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg.split('=', 1)[0] in SCHEDULER_OPTIONS:
+            skip = '=' not in arg
+        else:
+            options.append(arg)
+    return options
+
+
+def run_pinned(name, cpu, output):
+    """run the named benchmark in a new process pinned to the CPU,
+       returning its exit status and what it printed"""
+    cmd = [sys.executable, sys.argv[0]] + child_options(sys.argv[1:])
+    cmd.extend(('--only', name, '--affinity', str(cpu), '-o', output))
+    # perf pins its worker processes with --affinity, and we pin the
+    # process that starts them before it runs anything.
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT,
+                               universal_newlines=True,
+                               preexec_fn=lambda: os.sched_setaffinity(
+                                   0, {cpu}))
+    text, _ = process.communicate()
+    return process.returncode, text
+
+
+def bench_parallel(jobs, large_jobs, cpus, output):
+    """time every benchmark, running up to jobs of them at once"""
+    free_cpus = list(cpus[:jobs])
+    large_jobs = max(1, large_jobs)
+    todo = [(name, size) for name, impl, op, data_name, size in benchmarks()]
+    # Start the largest benchmarks first, since they take longest.
+    pending = sorted(range(len(todo)), key=lambda index: -todo[index][1])
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        def path(index):
+            return os.path.join(tmpdir, '%d.json' % index)
+
+        # Each free CPU gets the largest benchmark that may start, which
+        # is a small one once large_jobs large ones are running, rather
+        # than waiting for a large one to finish.
+        running = {}
+        large_running = 0
+        finished = {}
+        with concurrent.futures.ThreadPoolExecutor(len(free_cpus)) as executor:
+            while pending or running:
+                while free_cpus:
+                    for position, index in enumerate(pending):
+                        if (todo[index][1] < LARGE_SIZE or
+                                large_running < large_jobs):
+                            break
+                    else:
+                        break
+                    del pending[position]
+                    name, size = todo[index]
+                    cpu = free_cpus.pop()
+                    if size >= LARGE_SIZE:
+                        large_running += 1
+                    future = executor.submit(run_pinned, name, cpu,
+                                             path(index))
+                    running[future] = index, cpu
+                done, not_done = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    index, cpu = running.pop(future)
+                    free_cpus.append(cpu)
+                    if todo[index][1] >= LARGE_SIZE:
+                        large_running -= 1
+                    finished[index] = future.result()
+
+        # Report in the usual order, whatever order they finished in.
+        results = []
+        for index, (name, size) in enumerate(todo):
+            status, text = finished[index]
+            print(text, end='')
+            if status:
+                print('%s: failed with exit status %d' % (name, status))
+            else:
+                results.append(perf.Benchmark.load(path(index)))
+        perf.BenchmarkSuite(results).dump(output)
+
+
+def add_cmdline_args(cmd, args):
+    """pass our own options on to the perf worker processes"""
+    cmd.extend(('--seed', str(args.seed)))
+    if args.only is not None:
+        cmd.extend(('--only', args.only))
+
+
+def main():
+    runner = perf.Runner(add_cmdline_args=add_cmdline_args)
+    runner.argparser.add_argument(
+        '--memory', action='store_true',
+        help='measure memory use instead of time')
+    runner.argparser.add_argument(
+        '--count', action='store_true',
+        help='count comparisons and moves instead of measuring time')
+    runner.argparser.add_argument(
+        '--sweep', action='store_true',
+        help='time over a range of sizes and fit cost to log N')
+    runner.argparser.add_argument(
+        '--sweep-max', type=int, default=SWEEP_SIZES[-1], metavar='N',
+        help='largest heap size for --sweep (default: %(default)s)')
+    runner.argparser.add_argument(
+        '--latency', action='store_true',
+        help='report percentiles of the time taken by each operation')
+    runner.argparser.add_argument(
+        '--cache', action='store_true',
+        help='replay Zipf traffic against a cache using each heap')
+    runner.argparser.add_argument(
+        '--mmap', action='store_true',
+        help='compare a heap in a memory-mapped file with a list heap')
+    runner.argparser.add_argument(
+        '--peek', action='store_true',
+        help='time reading the first few items of a heap in order')
+    runner.argparser.add_argument(
+        '--profile', metavar='BENCHMARK',
+        help='profile one benchmark, given by name, instead of timing')
+    runner.argparser.add_argument(
+        '--profile-prefix', metavar='PREFIX',
+        default=os.path.join(RESULTS_DIR, 'profile'),
+        help='where to write the profile (default: %(default)s)')
+    runner.argparser.add_argument(
+        '--seed', type=int, default=0,
+        help='seed for the random data sets (default: %(default)s)')
+    runner.argparser.add_argument(
+        '--only', metavar='BENCHMARK',
+        help='time only one benchmark, given by name')
+    runner.argparser.add_argument(
+        '--jobs', type=int, default=1,
+        help='number of benchmarks to run at once, each pinned to its '
+             'own CPU (default: %(default)s)')
+    runner.argparser.add_argument(
+        '--large-jobs', type=int, default=4,
+        help='number of benchmarks with at least %d items to run at once '
+             '(default: %%(default)s)' % LARGE_SIZE)
+    runner.argparser.add_argument(
+        '--cpus', type=parse_cpus, metavar='LIST',
+        help='CPUs to run benchmarks on with --jobs (default: the '
+             'isolated CPUs, or all of them)')
+    args = runner.parse_args()
+    if args.memory:
+        bench_memory(args.seed,
+                     args.output or default_output('heapbench-memory'))
+    elif args.count:
+        bench_count(args.seed)
+    elif args.sweep:
+        bench_sweep(args.sweep_max, args.seed)
+    elif args.latency:
+        bench_latency(args.seed)
+    elif args.cache:
+        bench_cache(args.seed)
+    elif args.mmap:
+        bench_mmap(args.seed)
+    elif args.peek:
+        bench_peek(args.seed)
+    elif args.profile:
+        profile_benchmark(args.profile, args.profile_prefix, args.seed)
+    else:
+        add_metadata(runner)
+        if not args.worker and not args.output:
+            args.output = default_output()
+        if args.jobs > 1 and not args.worker and args.only is None:
+            bench_parallel(args.jobs, args.large_jobs,
+                           args.cpus or available_cpus(), args.output)
+        else:
+            bench_time(runner, args.seed, args.only)
+
+
+if __name__ == '__main__':
+    main()
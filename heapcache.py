@@ -0,0 +1,370 @@
+"""
+# Heap Caches
+
+A cache that holds a fixed number of items has to pick one to evict
+when it is full. Keeping the items in a heap, ordered by how much we
+want to keep them, makes that choice O(log n). Every access changes an
+item's priority, so the heap must also be able to update a priority in
+O(log n).
+
+The eviction policy decides the priority:
+
+* lru: the time of the last access, so the least recently used item
+  goes first.
+* lfu: the number of accesses, then the time of the last one.
+* cost: GreedyDual, where an item is worth the cost of fetching it
+  again, plus an inflation value that rises to the priority of each
+  evicted item, so that items which are not used age out.
+* ttl: the time that the item expires, so the item closest to expiry
+  goes first.
+
+With any policy, an item set with a time to live is a miss once it has
+expired.
+
+The heap itself is pluggable. A heap that can change priorities, like
+heapdict, is used directly. For a heap that can only push and pop, we
+push a new entry whenever a priority changes and mark the old one as
+removed, skipping removed entries when they reach the top.
+"""
+
+import heapq
+import itertools
+import time
+
+
+class HeapdictBackend(object):
+    """heap backend using a heapdict, which updates priorities itself"""
+
+    def __init__(self, heapdict_class):
+        self.heap = heapdict_class()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def set(self, key, priority):
+        """add the key, or change its priority"""
+        self.heap[key] = priority
+
+    def discard(self, key):
+        """remove the key if it is there"""
+        if key in self.heap:
+            del self.heap[key]
+
+    def pop(self):
+        """remove the key with the lowest priority, returning it and its
+           priority"""
+        return self.heap.popitem()
+
+
+class FibonacciBackend(object):
+    """heap backend using a Fibonacci heap, which can decrease a priority
+       in O(1) amortized time"""
+
+    def __init__(self, heap_class):
+        self.heap = heap_class()
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def set(self, key, priority):
+        """add the key, or change its priority"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            if priority < entry.get_priority():
+                self.heap.decrease_key(entry, priority)
+                return
+            self.heap.delete(entry)
+        self.entries[key] = self.heap.enqueue(key, priority)
+
+    def discard(self, key):
+        """remove the key if it is there"""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.heap.delete(entry)
+
+    def pop(self):
+        """remove the key with the lowest priority, returning it and its
+           priority"""
+        entry = self.heap.dequeue_min()
+        del self.entries[entry.get_value()]
+        return entry.get_value(), entry.get_priority()
+
+
+# Marks a lazy heap entry whose key has been removed or re-added.
+REMOVED = object()
+
+
+class LazyBackend(object):
+    """heap backend for any heap that can push and pop, which removes
+       entries lazily"""
+
+    def __init__(self, new=list, push=heapq.heappush, pop=heapq.heappop):
+        self.new = new
+        self.push = push
+        self.pop_entry = pop
+        self.heap = new()
+        self.entries = {}
+        self.removed = 0
+        # Breaks ties between priorities, so keys are never compared.
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def set(self, key, priority):
+        """add the key, or change its priority"""
+        self.discard(key)
+        entry = [priority, next(self.counter), key]
+        self.entries[key] = entry
+        self.push(self.heap, entry)
+
+    def discard(self, key):
+        """remove the key if it is there"""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            entry[-1] = REMOVED
+            self.removed += 1
+            # Rebuild the heap when it is mostly removed entries, so that
+            # it stays O(n) in size.
+            if self.removed > len(self.entries) + 64:
+                self.compact()
+
+    def compact(self):
+        """rebuild the heap without the removed entries"""
+        heap = self.new()
+        for entry in self.entries.values():
+            self.push(heap, entry)
+        self.heap = heap
+        self.removed = 0
+
+    def pop(self):
+        """remove the key with the lowest priority, returning it and its
+           priority"""
+        while True:
+            priority, count, key = self.pop_entry(self.heap)
+            if key is not REMOVED:
+                del self.entries[key]
+                return key, priority
+            self.removed -= 1
+
+
+# The lfu policy orders by the number of accesses and then by the time
+# of the last one. Both go into one number, count * LFU_SCALE + tick, as
+# fibonacci_heap_mod deletes an entry by lowering its priority to -inf,
+# which cannot be compared with a tuple.
+LFU_SCALE = 2 ** 40
+
+
+class HeapCache(object):
+    """cache of up to capacity items, keeping the items with the highest
+       priority under the eviction policy"""
+
+    POLICIES = ('lru', 'lfu', 'cost', 'ttl')
+
+    def __init__(self, capacity, backend, policy='lru', ttl=None,
+                 clock=time.monotonic):
+        if policy not in self.POLICIES:
+            raise ValueError('unknown eviction policy %r' % policy)
+        if policy == 'ttl' and ttl is None:
+            raise ValueError('the ttl policy needs a default ttl')
+        self.capacity = capacity
+        self.backend = backend
+        self.policy = policy
+        self.ttl = ttl
+        self.clock = clock
+        # Each item is a list of its value, cost, number of accesses,
+        # and expiry time, or None if it does not expire.
+        self.items = {}
+        self.ticks = itertools.count()
+        self.inflation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def priority(self, item):
+        """return the priority of an item that has just been used"""
+        if self.policy == 'lru':
+            return next(self.ticks)
+        if self.policy == 'lfu':
+            return item[2] * LFU_SCALE + next(self.ticks)
+        if self.policy == 'cost':
+            return self.inflation + item[1]
+        return item[3]
+
+    def get(self, key, default=None):
+        """return the value for the key, or default if it is missing or
+           has expired"""
+        item = self.items.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        if item[3] is not None and item[3] <= self.clock():
+            self.delete(key)
+            self.misses += 1
+            return default
+        self.hits += 1
+        item[2] += 1
+        if self.policy != 'ttl':
+            self.backend.set(key, self.priority(item))
+        return item[0]
+
+    def set(self, key, value, cost=1, ttl=None):
+        """add the key with its value, evicting an item if the cache is
+           full; cost is how expensive the value is to get again, and ttl
+           how many seconds it stays valid"""
+        if ttl is None:
+            ttl = self.ttl
+        expires = None if ttl is None else self.clock() + ttl
+        item = self.items.get(key)
+        if item is None:
+            if len(self.items) >= self.capacity:
+                self.evict()
+            item = self.items[key] = [value, cost, 1, expires]
+        else:
+            item[0:2] = value, cost
+            item[2] += 1
+            item[3] = expires
+        self.backend.set(key, self.priority(item))
+
+    def delete(self, key):
+        """remove the key from the cache if it is there"""
+        if self.items.pop(key, None) is not None:
+            self.backend.discard(key)
+
+    def evict(self):
+        """remove the item with the lowest priority, returning its key"""
+        key, priority = self.backend.pop()
+        del self.items[key]
+        if self.policy == 'cost':
+            self.inflation = priority
+        return key
+
+    def expire(self):
+        """remove every item that has expired, which is only quick with
+           the ttl policy, returning the number removed"""
+        now = self.clock()
+        if self.policy != 'ttl':
+            expired = [key for key, item in self.items.items()
+                       if item[3] is not None and item[3] <= now]
+            for key in expired:
+                self.delete(key)
+            return len(expired)
+        removed = 0
+        while self.items:
+            key, priority = self.backend.pop()
+            if priority > now:
+                self.backend.set(key, priority)
+                break
+            del self.items[key]
+            removed += 1
+        return removed
+
+
+__test__ = {
+    'lru': """
+    The least recently used item is evicted first:
+
+    >>> cache = HeapCache(2, LazyBackend())
+    >>> cache.set('a', 1)
+    >>> cache.set('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.set('c', 3)
+    >>> sorted(cache.items)
+    ['a', 'c']
+    >>> cache.get('b', 'missing')
+    'missing'
+    >>> cache.hits, cache.misses
+    (1, 1)
+    """,
+
+    'lfu': """
+    The least frequently used item is evicted first, and of those used
+    equally often, the least recently used:
+
+    >>> cache = HeapCache(2, LazyBackend(), policy='lfu')
+    >>> cache.set('a', 1)
+    >>> cache.set('b', 2)
+    >>> cache.get('a'), cache.get('a'), cache.get('b')
+    (1, 1, 2)
+    >>> cache.set('c', 3)
+    >>> sorted(cache.items)
+    ['a', 'c']
+    >>> cache.set('d', 4)
+    >>> sorted(cache.items)
+    ['a', 'd']
+    """,
+
+    'cost': """
+    An item that is expensive to get again outlives cheap ones, but the
+    inflation rises with each eviction until it goes too:
+
+    >>> cache = HeapCache(2, LazyBackend(), policy='cost')
+    >>> cache.set('dear', 0, cost=3)
+    >>> for n in range(3):
+    ...     cache.set(n, n)
+    ...     print(sorted(cache.items, key=str), cache.inflation)
+    [0, 'dear'] 0
+    [1, 'dear'] 1
+    [2, 'dear'] 2
+    >>> cache.set(3, 3)
+    >>> sorted(cache.items, key=str), cache.inflation
+    ([2, 3], 3)
+    """,
+
+    'ttl': """
+    Items expire after their time to live, and the ttl policy evicts the
+    item closest to expiry:
+
+    >>> now = 0.0
+    >>> cache = HeapCache(3, LazyBackend(), policy='ttl', ttl=5,
+    ...                   clock=lambda: now)
+    >>> cache.set('a', 1)
+    >>> cache.set('b', 2, ttl=20)
+    >>> cache.set('c', 3, ttl=10)
+    >>> cache.set('d', 4)
+    >>> sorted(cache.items)
+    ['b', 'c', 'd']
+    >>> now = 12.0
+    >>> cache.get('d', 'expired')
+    'expired'
+    >>> cache.expire()
+    1
+    >>> sorted(cache.items)
+    ['b']
+
+    With another policy, an item set with a ttl still expires:
+
+    >>> cache = HeapCache(3, LazyBackend(), clock=lambda: now)
+    >>> cache.set('a', 1, ttl=1)
+    >>> cache.set('b', 2)
+    >>> now = 13.5
+    >>> cache.get('a', 'expired'), cache.get('b')
+    ('expired', 2)
+    """,
+
+    'compact': """
+    The lazy backend rebuilds its heap once it is mostly removed entries:
+
+    >>> backend = LazyBackend()
+    >>> for n in range(100):
+    ...     backend.set('key', n)
+    >>> len(backend), len(backend.heap)
+    (1, 35)
+    >>> backend.pop()
+    ('key', 99)
+    >>> len(backend), len(backend.heap)
+    (0, 0)
+    """,
+}
+
+
+if __name__ == '__main__':
+    import doctest
+    print(doctest.testmod())
@@ -0,0 +1,202 @@
+"""
+# Comparing Results
+
+heapbench.py saves the results of each run as perf JSON. This compares
+two of those files, benchmark by benchmark, and reports which ones got
+significantly faster or slower, or for --memory results, smaller or
+larger:
+
+    $ python3 heapcompare.py results/old.json results/new.json
+
+With only one file, it is compared against the stored baseline in
+results/baseline.json.
+
+A change is reported when Welch's t-test finds it significant at the
+95% level and it is also larger than a minimum relative change, since
+with enough values even a tiny difference becomes significant. The
+exit status is 1 if any benchmark regressed, so this can be used in CI.
+
+Its doctests run with python3 -m doctest heapcompare.py.
+"""
+
+import argparse
+import math
+import os
+import statistics
+import sys
+
+import perf
+
+# The baseline used when only one file is given.
+BASELINE = os.path.join('results', 'baseline.json')
+
+# Two-sided 95% critical values of Student's t distribution, for 1 to 30
+# degrees of freedom. Beyond that the normal distribution is close enough.
+T_CRITICAL = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+]
+
+# Metadata worth showing when it differs between the two runs.
+METADATA = [
+    'python_version',
+    'python_implementation',
+    'cpu_model_name',
+    'binaryheap_version',
+    'fibonacci_heap_mod_version',
+    'heapdict_version',
+    'heapqueue_version',
+]
+
+
+def is_significant(old, new):
+    """return True if Welch's t-test finds the means of the two lists of
+       values different at the 95% level
+
+    >>> is_significant([1.0, 1.0, 1.0], [1.0, 1.0, 1.0])
+    False
+    >>> is_significant([1.0, 1.0, 1.0], [2.0, 2.0, 2.0])
+    True
+    >>> is_significant([1.0], [2.0])
+    False
+    >>> is_significant([1.0, 1.1, 0.9, 1.0], [1.05, 0.95, 1.1, 0.9])
+    False
+    >>> is_significant([1.0, 1.1, 0.9, 1.0], [2.0, 2.1, 1.9, 2.0])
+    True
+
+    With many values the degrees of freedom go past the table:
+
+    >>> is_significant([1.0, 1.2] * 20, [1.1, 1.3] * 20)
+    True
+    >>> is_significant([1.0, 1.2] * 20, [1.01, 1.21] * 20)
+    False
+    """
+    if len(old) < 2 or len(new) < 2:
+        return False
+    old_var = statistics.variance(old) / len(old)
+    new_var = statistics.variance(new) / len(new)
+    if old_var + new_var == 0:
+        return statistics.mean(old) != statistics.mean(new)
+    t = (statistics.mean(new) - statistics.mean(old)) / math.sqrt(
+        old_var + new_var)
+    # The Welch-Satterthwaite estimate of the degrees of freedom.
+    df = (old_var + new_var) ** 2 / (old_var ** 2 / (len(old) - 1) +
+                                     new_var ** 2 / (len(new) - 1))
+    df = max(1, int(df))
+    critical = T_CRITICAL[df - 1] if df <= len(T_CRITICAL) else 1.96
+    return abs(t) > critical
+
+
+def format_seconds(value):
+    """format a number of seconds the way perf does
+
+    >>> format_seconds(0.0123), format_seconds(1.5e-7)
+    ('12.30 ms', '150 ns')
+    """
+    for unit, scale in (('sec', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if value >= scale:
+            return '%.2f %s' % (value / scale, unit)
+    return '%.0f ns' % (value / 1e-9)
+
+
+def format_bytes(value):
+    """format a number of bytes the way perf does"""
+    for unit in ('B', 'kB', 'MB'):
+        if abs(value) < 1024:
+            return '%.1f %s' % (value, unit)
+        value /= 1024
+    return '%.1f GB' % value
+
+
+# How to format the values of each perf unit.
+FORMATS = {
+    'second': format_seconds,
+    'byte': format_bytes,
+    'integer': lambda value: '%.2f' % value,
+}
+
+
+def load(filename):
+    """return the benchmarks in a perf JSON file, keyed by name"""
+    suite = perf.BenchmarkSuite.load(filename)
+    return {bench.get_name(): bench for bench in suite.get_benchmarks()}
+
+
+def compare_metadata(old, new):
+    """print the metadata that differs between the two runs"""
+    if not old or not new:
+        return
+    old_metadata = next(iter(old.values())).get_metadata()
+    new_metadata = next(iter(new.values())).get_metadata()
+    for key in METADATA:
+        old_value = old_metadata.get(key, 'unknown')
+        new_value = new_metadata.get(key, 'unknown')
+        if old_value != new_value:
+            print('%s: %s -> %s' % (key, old_value, new_value))
+
+
+def compare(old, new, min_change):
+    """print how each benchmark changed, returning the number of
+       regressions"""
+    regressions = 0
+    for name in old:
+        if name not in new:
+            print('%s: missing from new results' % name)
+            continue
+        unit = old[name].get_metadata().get('unit', 'second')
+        fmt = FORMATS[unit]
+        if unit == 'second':
+            worse, better = 'slower', 'faster'
+        else:
+            worse, better = 'larger', 'smaller'
+        old_values = old[name].get_values()
+        new_values = new[name].get_values()
+        old_mean = statistics.mean(old_values)
+        new_mean = statistics.mean(new_values)
+        change = new_mean / old_mean
+        if (not is_significant(old_values, new_values) or
+                abs(change - 1) < min_change):
+            verdict = 'not significant'
+        elif change > 1:
+            verdict = '%.2fx %s, REGRESSION' % (change, worse)
+            regressions += 1
+        else:
+            verdict = '%.2fx %s, improvement' % (1 / change, better)
+        print('%s: %s -> %s: %s' % (name, fmt(old_mean), fmt(new_mean),
+                                    verdict))
+    for name in new:
+        if name not in old:
+            print('%s: missing from old results' % name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='compare two sets of heapbench.py results')
+    parser.add_argument('files', nargs='+', metavar='FILE',
+                        help='the old and new results, or only the new '
+                             'results to compare with %s' % BASELINE)
+    parser.add_argument('--min-change', type=float, default=2.0,
+                        metavar='PERCENT',
+                        help='smallest change to report '
+                             '(default: %(default)s%%)')
+    args = parser.parse_args()
+    if len(args.files) == 1:
+        old_file, new_file = BASELINE, args.files[0]
+    elif len(args.files) == 2:
+        old_file, new_file = args.files
+    else:
+        parser.error('expected one or two files')
+
+    old = load(old_file)
+    new = load(new_file)
+    compare_metadata(old, new)
+    regressions = compare(old, new, args.min_change / 100)
+    if regressions:
+        print('%d regressions' % regressions)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
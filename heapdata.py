@@ -0,0 +1,117 @@
+"""
+# Data Sets
+
+The order that items arrive in can matter a lot to a heap. Fully
+sorted, reversed, and shuffled input are the classic cases, but real
+priority queues usually see something in between. This module builds
+each of the data sets that we benchmark with.
+
+Every data set is a list of tuples whose first element is the priority.
+Some implementations keep items in a dictionary, so items must all be
+distinct; where priorities repeat, the position in the list is added
+as a second element to break the tie.
+
+All of the randomness comes from the random.Random object passed in, so
+a data set can be reproduced exactly from its seed.
+"""
+
+import itertools
+import random
+
+
+def ascending(size, rng):
+    """items in order, smallest to largest"""
+    return [(n,) for n in range(size)]
+
+
+def descending(size, rng):
+    """items in reverse order, largest to smallest"""
+    return [(n,) for n in range(size, 0, -1)]
+
+
+def shuffled(size, rng):
+    """items in random order"""
+    items = descending(size, rng)
+    rng.shuffle(items)
+    return items
+
+
+def nearly_sorted(size, rng, k=10):
+    """items in order, except that each is up to k places from where it
+       belongs"""
+    # Adding noise of less than k to each position means an item can
+    # only be passed by items fewer than k places behind it.
+    keys = sorted(range(size), key=lambda n: n + rng.random() * k)
+    return [(n,) for n in keys]
+
+
+def duplicates(size, rng, distinct=16):
+    """items in random order, using only a few different priorities"""
+    return [(rng.randrange(distinct), n) for n in range(size)]
+
+
+def sawtooth(size, rng, teeth=10):
+    """several runs of ascending items"""
+    period = max(1, size // teeth)
+    return [(n % period, n) for n in range(size)]
+
+
+def organ_pipe(size, rng):
+    """items ascending to the middle, then descending again"""
+    return [(min(n, size - 1 - n), n) for n in range(size)]
+
+
+def zipf(size, rng, s=1.1):
+    """items with priorities drawn from a Zipf distribution, so that a
+       few small priorities are very common"""
+    weights = itertools.accumulate(1 / rank ** s
+                                   for rank in range(1, size + 1))
+    keys = rng.choices(range(size), cum_weights=list(weights), k=size)
+    return [(key, n) for n, key in enumerate(keys)]
+
+
+def timers(size, rng, count=100, jitter=0.1):
+    """items as a scheduler sees periodic timers, each inserted when its
+       previous expiry fires, with some jitter on every period"""
+    count = max(1, min(count, size))
+    periods = [rng.randrange(1000, 10000) for n in range(count)]
+    # Each timer starts at a random point within its first period.
+    scheduled = [rng.randrange(period) for period in periods]
+    events = []
+    for n in range(size):
+        timer = n % count
+        period = periods[timer]
+        deadline = scheduled[timer] + period
+        deadline += int(rng.uniform(-jitter, jitter) * period)
+        events.append((scheduled[timer], deadline))
+        scheduled[timer] = deadline
+    # Insert the timers in the order in which they are rescheduled.
+    events.sort()
+    return [(deadline, n) for n, (when, deadline) in enumerate(events)]
+
+
+# The name used in reports and the function building each data set.
+DATASETS = [
+    ('ascending', ascending),
+    ('descending', descending),
+    ('random order', shuffled),
+    ('nearly sorted', nearly_sorted),
+    ('duplicate keys', duplicates),
+    ('sawtooth', sawtooth),
+    ('organ pipe', organ_pipe),
+    ('zipf', zipf),
+    ('jittered timers', timers),
+]
+
+
+def dataset(name, size, seed):
+    """return the items of the named data set of the given size"""
+    # A fresh generator for each data set means that adding a data set
+    # does not change the ones after it.
+    return dict(DATASETS)[name](size, random.Random(seed))
+
+
+def datasets(size, seed):
+    """generate the name and items of each data set of the given size"""
+    for name, build in DATASETS:
+        yield name, dataset(name, size, seed)
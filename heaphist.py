@@ -0,0 +1,85 @@
+"""
+# Latency Histograms
+
+A mean hides the occasional slow operation, which is what a scheduler
+cares about. This keeps a histogram of latencies in the style of
+HdrHistogram: values are counted in buckets whose width grows with the
+value, so that every bucket is accurate to a fixed number of
+significant bits no matter how large the value is. Recording a value
+is a shift and a dictionary update, so it adds little to the code being
+measured.
+"""
+
+
+class LatencyHistogram(object):
+    """histogram of integer latencies, each counted in a bucket accurate
+       to the given number of significant bits"""
+
+    def __init__(self, precision=7):
+        self.precision = precision
+        self.counts = {}
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        """count one value"""
+        if value > self.max:
+            self.max = value
+        shift = value.bit_length() - self.precision
+        if shift > 0:
+            value = value >> shift << shift
+        self.counts[value] = self.counts.get(value, 0) + 1
+        self.total += 1
+
+    def bucket_end(self, bucket):
+        """return the largest value that is counted in a bucket"""
+        shift = bucket.bit_length() - self.precision
+        if shift > 0:
+            return bucket + (1 << shift) - 1
+        return bucket
+
+    def percentile(self, percent):
+        """return the value that the given percentage of values are at or
+           below, rounded up to the end of its bucket"""
+        if not self.total:
+            return 0
+        wanted = self.total * percent / 100
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= wanted:
+                return min(self.bucket_end(bucket), self.max)
+        return self.max
+
+
+__test__ = {
+    'percentiles': """
+    Values below 2**precision are counted exactly, and larger ones in
+    buckets that widen with the value:
+
+    >>> hist = LatencyHistogram()
+    >>> hist.bucket_end(100), hist.bucket_end(128), hist.bucket_end(992)
+    (100, 129, 999)
+
+    A percentile is rounded up to the end of its bucket:
+
+    >>> for value in range(1, 1001):
+    ...     hist.record(value)
+    >>> hist.percentile(50), hist.percentile(99), hist.max
+    (503, 991, 1000)
+
+    but never past the largest value recorded:
+
+    >>> hist = LatencyHistogram()
+    >>> hist.record(1000)
+    >>> hist.percentile(99)
+    1000
+    >>> LatencyHistogram().percentile(99)
+    0
+    """,
+}
+
+
+if __name__ == '__main__':
+    import doctest
+    print(doctest.testmod())
@@ -0,0 +1,409 @@
+"""
+# Memory-Mapped Heaps
+
+A heap of fixed-size numeric records, kept in a memory-mapped file. A
+scheduler using it can restart without rebuilding its queue: reopening
+the file only reads the header, however many records there are.
+
+The records are packed with the struct module, and the first field is
+the priority. MmapHeap looks like a list to pyheapq, so pushing and
+popping use exactly the same _siftdown() and _siftup() as the in-memory
+heap does.
+
+To survive a crash in the middle of an operation, the records that an
+operation changes are first collected in memory. When it is done they
+are written to a journal in the file, the journal is marked committed,
+and then they are copied into place. If the process dies after the
+journal is committed, the copy is finished when the file is next
+opened; if it dies before, the heap is as it was before the operation.
+That is enough if only the process crashes. To also survive the whole
+machine crashing, use sync=True, which flushes the file to disk at each
+step, at a much higher cost per operation. A new file is written under
+a temporary name and renamed into place, so a crash while creating one
+leaves no file at all rather than a half-written one.
+
+File layout:
+
+    header      magic, record format, count, capacity
+    journal     committed flag, new count, number of entries
+    entries     JOURNAL_ENTRIES x (index, record)
+    records     capacity x record
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+
+import pyheapq
+
+MAGIC = b'MMAPHEAP'
+
+HEADER = struct.Struct('<8s32sQQ')          # magic, format, count, capacity
+JOURNAL = struct.Struct('<QQQ')             # committed, count, entries
+JOURNAL_OFFSET = HEADER.size
+INDEX = struct.Struct('<Q')
+FLAG = struct.Struct('<Q')
+
+# One operation changes at most two paths from the root to a leaf, so
+# this is enough for any heap that fits in 64-bit offsets.
+JOURNAL_ENTRIES = 256
+
+
+def _data_offset(record):
+    """return where the records start in a file of the given records"""
+    return (JOURNAL_OFFSET + JOURNAL.size +
+            JOURNAL_ENTRIES * (INDEX.size + record.size))
+
+
+def _write_file(path, record_format, capacity, records, sync):
+    """write a complete heap file of the records, which must already be
+       a heap"""
+    record = struct.Struct(record_format)
+    # The file is written under another name and then renamed, so that a
+    # crash cannot leave a half-written file at path.
+    fd, temp_path = tempfile.mkstemp(prefix='.mmapheap-',
+                                     dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, record_format.encode('ascii'),
+                                len(records), capacity))
+            f.write(bytes(_data_offset(record) - HEADER.size))
+            f.write(b''.join(record.pack(*r) for r in records))
+            f.truncate(_data_offset(record) + capacity * record.size)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    if sync:
+        # Make the rename itself durable.
+        fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class MmapHeap(object):
+    """heap of fixed-size records in a memory-mapped file"""
+
+    def __init__(self, path, record_format='<dq', capacity=1024,
+                 sync=False):
+        """open the heap in the file at path, creating it if it does not
+           exist; record_format and capacity only apply to a new file"""
+        self.path = path
+        self.sync = sync
+        if not os.path.exists(path):
+            _write_file(path, record_format, capacity, [], sync)
+        self.file = open(path, 'r+b')
+        try:
+            header = self.file.read(HEADER.size)
+            if len(header) < HEADER.size or not header.startswith(MAGIC):
+                raise ValueError('%s is not a heap file' % path)
+            magic, fmt, count, capacity = HEADER.unpack(header)
+            self.record = struct.Struct(fmt.rstrip(b'\0').decode('ascii'))
+            self.entry_size = INDEX.size + self.record.size
+            self.data_offset = _data_offset(self.record)
+            self.mm = mmap.mmap(self.file.fileno(), 0)
+        except BaseException:
+            self.file.close()
+            raise
+        self.capacity = capacity
+        self._recover()
+        self.count = self._header_count()
+        # Records changed by the operation in progress, by index.
+        self.pending = {}
+
+    @classmethod
+    def create(cls, path, records, record_format='<dq', sync=False):
+        """create a new heap file holding the records, which is quicker
+           than pushing them one at a time"""
+        if os.path.exists(path):
+            raise FileExistsError(path)
+        # The records are laid out as pyheapq.heapify() lays out a list,
+        # so the file holds the same heap as a list built from them.
+        heap = [tuple(record) for record in records]
+        pyheapq.heapify(heap)
+        _write_file(path, record_format, max(len(heap), 1), heap, sync)
+        return cls(path, sync=sync)
+
+    def close(self):
+        """unmap and close the file"""
+        self._flush()
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    #
+    # The list methods that pyheapq uses. During an operation, changes
+    # only go to self.pending.
+    #
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError('heap index out of range')
+        record = self.pending.get(index)
+        if record is None:
+            record = self.record.unpack_from(
+                self.mm, self.data_offset + index * self.record.size)
+        return record
+
+    def __setitem__(self, index, record):
+        if not 0 <= index < self.count:
+            raise IndexError('heap index out of range')
+        self.pending[index] = tuple(record)
+
+    def append(self, record):
+        if self.count >= self.capacity:
+            self._grow()
+        self.count += 1
+        self.pending[self.count - 1] = tuple(record)
+
+    def pop(self):
+        record = self[self.count - 1]   # raises IndexError if heap is empty
+        self.count -= 1
+        self.pending.pop(self.count, None)
+        return record
+
+    #
+    # Heap operations, each committed to the file as a whole.
+    #
+
+    def push(self, record):
+        """push a record onto the heap"""
+        try:
+            pyheapq.heappush(self, tuple(record))
+        except BaseException:
+            self._abort()
+            raise
+        self._commit()
+
+    def popmin(self):
+        """pop the record with the smallest priority off the heap"""
+        try:
+            record = pyheapq.heappop(self)
+        except BaseException:
+            self._abort()
+            raise
+        self._commit()
+        return record
+
+    def pushpop(self, record):
+        """push a record and then pop the smallest, more quickly than
+           push() and popmin()"""
+        try:
+            record = pyheapq.heappushpop(self, tuple(record))
+        except BaseException:
+            self._abort()
+            raise
+        self._commit()
+        return record
+
+    #
+    # Journaling.
+    #
+
+    def _flush(self):
+        if self.sync:
+            self.mm.flush()
+
+    def _header_count(self):
+        return HEADER.unpack_from(self.mm, 0)[2]
+
+    def _set_count(self, count):
+        magic, fmt, old_count, capacity = HEADER.unpack_from(self.mm, 0)
+        HEADER.pack_into(self.mm, 0, magic, fmt, count, capacity)
+
+    def _abort(self):
+        """forget the changes made by the operation in progress"""
+        self.pending.clear()
+        self.count = self._header_count()
+
+    def _commit(self):
+        """write the changes made by the operation in progress to the
+           file"""
+        # Only records below the new count need to be kept.
+        entries = [(index, record) for index, record in self.pending.items()
+                   if index < self.count]
+        if len(entries) > JOURNAL_ENTRIES:
+            self._abort()
+            raise RuntimeError('too many changes for the journal')
+        offset = JOURNAL_OFFSET + JOURNAL.size
+        try:
+            for index, record in entries:
+                INDEX.pack_into(self.mm, offset, index)
+                self.record.pack_into(self.mm, offset + INDEX.size, *record)
+                offset += self.entry_size
+        except struct.error:
+            # Nothing has been committed, so the file is unchanged.
+            self._abort()
+            raise
+        JOURNAL.pack_into(self.mm, JOURNAL_OFFSET, 0, self.count,
+                          len(entries))
+        self._flush()
+        FLAG.pack_into(self.mm, JOURNAL_OFFSET, 1)
+        self._flush()
+        self._replay()
+        self.pending.clear()
+
+    def _replay(self):
+        """copy a committed journal into place, and mark it done"""
+        committed, count, entries = JOURNAL.unpack_from(self.mm,
+                                                        JOURNAL_OFFSET)
+        size = self.record.size
+        offset = JOURNAL_OFFSET + JOURNAL.size
+        for entry in range(entries):
+            index, = INDEX.unpack_from(self.mm, offset)
+            start = offset + INDEX.size
+            dest = self.data_offset + index * size
+            self.mm[dest:dest + size] = self.mm[start:start + size]
+            offset += self.entry_size
+        self._set_count(count)
+        self._flush()
+        FLAG.pack_into(self.mm, JOURNAL_OFFSET, 0)
+        self._flush()
+
+    def _recover(self):
+        """finish an operation that was committed before a crash"""
+        committed, = FLAG.unpack_from(self.mm, JOURNAL_OFFSET)
+        if committed:
+            self._replay()
+
+    def _grow(self):
+        """double the capacity of the file"""
+        capacity = self.capacity * 2
+        self.mm.close()
+        self.file.truncate(self.data_offset + capacity * self.record.size)
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        magic, fmt, count, old_capacity = HEADER.unpack_from(self.mm, 0)
+        HEADER.pack_into(self.mm, 0, magic, fmt, count, capacity)
+        self._flush()
+        self.capacity = capacity
+
+
+__test__ = {
+    'heap': """
+    >>> import os, shutil, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> path = os.path.join(directory, 'heap')
+    >>> heap = MmapHeap(path, capacity=2)
+    >>> for record in [(3.0, 1), (1.0, 2), (4.0, 3), (1.5, 4), (5.0, 5)]:
+    ...     heap.push(record)
+    >>> heap.capacity
+    8
+    >>> heap.popmin()
+    (1.0, 2)
+    >>> heap.pushpop((2.0, 6))
+    (1.5, 4)
+    >>> heap.close()
+
+    Reopening the file finds the records as they were:
+
+    >>> heap = MmapHeap(path)
+    >>> len(heap), heap.capacity
+    (4, 8)
+    >>> [heap.popmin() for n in range(len(heap))]
+    [(2.0, 6), (3.0, 1), (4.0, 3), (5.0, 5)]
+    >>> heap.close()
+    >>> shutil.rmtree(directory)
+    """,
+
+    'create': """
+    >>> import os, shutil, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> path = os.path.join(directory, 'heap')
+    >>> heap = MmapHeap.create(path, [(2.0, 1), (1.0, 2)], sync=True)
+    >>> heap.popmin(), len(heap), heap.capacity
+    ((1.0, 2), 1, 2)
+    >>> heap.close()
+    >>> MmapHeap.create(path, [])
+    Traceback (most recent call last):
+    ...
+    FileExistsError: ...
+
+    If creating a file fails part way, nothing is left behind:
+
+    >>> MmapHeap.create(os.path.join(directory, 'bad'), [(1.0, 2), (3.0,)])
+    Traceback (most recent call last):
+    ...
+    struct.error: ...
+    >>> os.listdir(directory)
+    ['heap']
+
+    A file that is not a heap is refused:
+
+    >>> with open(os.path.join(directory, 'other'), 'wb') as f:
+    ...     f.write(b'not a heap')
+    10
+    >>> MmapHeap(os.path.join(directory, 'other'))
+    Traceback (most recent call last):
+    ...
+    ValueError: ... is not a heap file
+    >>> shutil.rmtree(directory)
+    """,
+
+    'crash': """
+    A crash after the journal is committed, but before it is copied into
+    place, is finished when the file is opened again:
+
+    >>> import os, shutil, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> path = os.path.join(directory, 'heap')
+    >>> heap = MmapHeap.create(path, [(1.0, 1), (2.0, 2), (3.0, 3)])
+    >>> heap._replay = lambda: None
+    >>> heap.push((0.5, 4))
+    >>> heap._header_count()
+    3
+    >>> heap.close()
+    >>> heap = MmapHeap(path)
+    >>> [heap.popmin() for n in range(len(heap))]
+    [(0.5, 4), (1.0, 1), (2.0, 2), (3.0, 3)]
+    >>> heap.close()
+    >>> shutil.rmtree(directory)
+    """,
+
+    'abort': """
+    An operation that fails leaves the heap as it was:
+
+    >>> import os, shutil, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> path = os.path.join(directory, 'heap')
+    >>> heap = MmapHeap.create(path, [(1.0, 1), (2.0, 2), (3.0, 3)])
+    >>> heap.push((None, 4))
+    Traceback (most recent call last):
+    ...
+    TypeError: ...
+    >>> heap.push((0.5,))
+    Traceback (most recent call last):
+    ...
+    struct.error: ...
+    >>> len(heap), heap.pending
+    (3, {})
+    >>> heap.close()
+    >>> heap = MmapHeap(path)
+    >>> [heap.popmin() for n in range(len(heap))]
+    [(1.0, 1), (2.0, 2), (3.0, 3)]
+    >>> heap.popmin()
+    Traceback (most recent call last):
+    ...
+    IndexError: heap index out of range
+    >>> heap.close()
+    >>> shutil.rmtree(directory)
+    """,
+}
+
+
+if __name__ == '__main__':
+    import doctest
+    print(doctest.testmod(optionflags=doctest.ELLIPSIS))
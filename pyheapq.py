@@ -125,7 +125,7 @@ From all times, sorting has always been a Great Art! :-)
 """
 
 __all__ = ['heappush', 'heappop', 'heapify', 'heapreplace', 'merge',
-           'nlargest', 'nsmallest', 'heappushpop']
+           'nlargest', 'nsmallest', 'heappushpop', 'iter_sorted']
 
 def heappush(heap, item):
     """Push item onto heap, maintaining the heap invariant."""
@@ -275,6 +275,74 @@ def _siftup(heap, pos):
     heap[pos] = newitem
     _siftdown(heap, startpos, pos)
 
+# Counting variants of _siftdown and _siftup, for measuring how much work
+# the heap operations do independently of the speed of the machine.  They
+# are only used after enable_counters() swaps them in, so that the normal
+# versions pay nothing for the instrumentation.
+
+counters = {
+    'siftdown_loops': 0,    # iterations of the _siftdown loop
+    'siftdown_moves': 0,    # items stored into the heap by _siftdown
+    'siftup_loops': 0,      # iterations of the _siftup loop
+    'siftup_moves': 0,      # items stored into the heap by _siftup
+}
+
+def _siftdown_counted(heap, startpos, pos):
+    'Counting variant of _siftdown'
+    newitem = heap[pos]
+    while pos > startpos:
+        counters['siftdown_loops'] += 1
+        parentpos = (pos - 1) >> 1
+        parent = heap[parentpos]
+        if newitem < parent:
+            heap[pos] = parent
+            counters['siftdown_moves'] += 1
+            pos = parentpos
+            continue
+        break
+    heap[pos] = newitem
+    counters['siftdown_moves'] += 1
+
+def _siftup_counted(heap, pos):
+    'Counting variant of _siftup'
+    endpos = len(heap)
+    startpos = pos
+    newitem = heap[pos]
+    childpos = 2*pos + 1    # leftmost child position
+    while childpos < endpos:
+        counters['siftup_loops'] += 1
+        rightpos = childpos + 1
+        if rightpos < endpos and not heap[childpos] < heap[rightpos]:
+            childpos = rightpos
+        heap[pos] = heap[childpos]
+        counters['siftup_moves'] += 1
+        pos = childpos
+        childpos = 2*pos + 1
+    heap[pos] = newitem
+    counters['siftup_moves'] += 1
+    _siftdown(heap, startpos, pos)
+
+_siftdown_uncounted = _siftdown
+_siftup_uncounted = _siftup
+
+def reset_counters():
+    """Set all of the sift counters back to zero."""
+    for key in counters:
+        counters[key] = 0
+
+def enable_counters():
+    """Reset the sift counters and start counting."""
+    global _siftdown, _siftup
+    reset_counters()
+    _siftdown = _siftdown_counted
+    _siftup = _siftup_counted
+
+def disable_counters():
+    """Stop counting, leaving the sift counters with their last values."""
+    global _siftdown, _siftup
+    _siftdown = _siftdown_uncounted
+    _siftup = _siftup_uncounted
+
 def _siftdown_max(heap, startpos, pos):
     'Maxheap variant of _siftdown'
     newitem = heap[pos]
@@ -311,6 +379,39 @@ def _siftup_max(heap, pos):
     heap[pos] = newitem
     _siftdown_max(heap, startpos, pos)
 
+def iter_sorted(heap):
+    '''Generate the items of a heap in ascending order, leaving it unchanged.
+
+    The next item is always the smallest child of an item already produced,
+    so a second, small heap of candidates is enough to find it.  Producing
+    the first k items costs O(k log k), however large the heap is.
+
+    >>> heap = [5, 1, 8, 3, 2, 8, 0]
+    >>> heapify(heap)
+    >>> list(iter_sorted(heap))
+    [0, 1, 2, 3, 5, 8, 8]
+    >>> heap[0]
+    0
+
+    The heap must not be changed while the generator is in use.
+
+    '''
+    n = len(heap)
+    if not n:
+        return
+    # Candidates are (item, index) pairs.  The index is unique, so it breaks
+    # ties without going on to compare anything else.
+    frontier = [(heap[0], 0)]
+    while frontier:
+        item, pos = heappop(frontier)
+        yield item
+        childpos = 2*pos + 1
+        if childpos < n:
+            heappush(frontier, (heap[childpos], childpos))
+            childpos += 1
+            if childpos < n:
+                heappush(frontier, (heap[childpos], childpos))
+
 def merge(*iterables, key=None, reverse=False):
     '''Merge multiple sorted inputs into a single sorted output.
 